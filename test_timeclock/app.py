@@ -1,11 +1,11 @@
 import streamlit as st
 import uuid
-from datetime import datetime
-import pandas as pd
-from db_config import get_connection
-from utils import find_customer_from_location
+from datetime import datetime, timezone
+from db_config import get_cursor
+from utils import clock_in, clock_out, find_customer_from_location, get_active_session, lookup_user, point_frame, submit_write
 from streamlit_geolocation import streamlit_geolocation
 from streamlit_cookies_controller import CookieController
+from styles import CSS
 
 # Set page config must be the first Streamlit command
 st.set_page_config(
@@ -19,70 +19,7 @@ st.set_page_config(
 cookies = CookieController()
 
 # Simple, clean CSS
-st.markdown("""
-<style>
-    /* Main container */
-    .main {
-        max-width: 800px;
-        margin: 0 auto;
-        padding: 2rem;
-    }
-    
-    /* Header styling */
-    .header {
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    
-    /* Card styling */
-    .card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 8px;
-        margin: 1rem 0;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-    
-    /* Status message styling */
-    .status-message {
-        text-align: center;
-        padding: 1rem;
-        margin: 1rem 0;
-        border-radius: 8px;
-        background: #f8f9fa;
-    }
-    
-    /* Button styling */
-    .stButton > button {
-        width: 100%;
-        padding: 0.75rem;
-        border-radius: 8px;
-        background: #007bff;
-        color: white;
-        border: none;
-    }
-    
-    .stButton > button:hover {
-        background: #0056b3;
-    }
-    
-    /* Input field styling */
-    .stTextInput > div > div > input {
-        border-radius: 8px;
-        padding: 0.75rem;
-    }
-    
-    /* Map container styling */
-    .map-container {
-        border-radius: 8px;
-        overflow: hidden;
-        margin: 1rem 0;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Main container
-st.markdown('<div class="main">', unsafe_allow_html=True)
+st.markdown(CSS, unsafe_allow_html=True)
 
 # Header
 st.markdown("""
@@ -92,52 +29,66 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Device identification
-stored_device_id = cookies.get("device_id")  
-device_id = stored_device_id or str(uuid.uuid4())
-if not stored_device_id:
-    cookies.set("device_id", device_id)
+# Device identification, read from the cookie once per session
+if "device_id" not in st.session_state:
+    stored_device_id = cookies.get("device_id")
+    st.session_state["device_id"] = stored_device_id or str(uuid.uuid4())
+    if not stored_device_id:
+        cookies.set("device_id", st.session_state["device_id"])
+device_id = st.session_state["device_id"]
 
 # Get subcontractor name
-st.markdown('<div class="card">', unsafe_allow_html=True)
 sub = st.text_input("Subcontractor Name", placeholder="Enter subcontractor name")
-st.markdown('</div>', unsafe_allow_html=True)
 
 if not sub:
     st.error("Please enter your subcontractor name")
     st.stop()
 
-# User registration check
+# Clock in/out writes run in the background; report failures from the last one
+pending_write = st.session_state.get("pending_write")
+if pending_write is not None and pending_write.done():
+    del st.session_state["pending_write"]
+    if pending_write.exception() is not None:
+        st.error(f"Database error: {str(pending_write.exception())}")
+
+# Nothing else reruns the script once the write lands, so poll it until it
+# finishes and then rerun the app to report the outcome and resync the state
+if "pending_write" in st.session_state:
+    @st.fragment(run_every=1)
+    def _await_pending_write():
+        pending = st.session_state.get("pending_write")
+        if pending is None or pending.done():
+            st.rerun()
+    _await_pending_write()
+
+# User registration check; once registered, reruns only refresh the active session
 try:
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT Employee, Number FROM SubContractorEmployees WHERE Cookies = ?", device_id)
-            user_data = cursor.fetchone()
-            
-            if user_data:
-                st.session_state.update({
-                    "registered": True,
-                    "user_name": user_data[0],
-                    "user_number": user_data[1]
-                })
-                
-                # Check for active sessions by phone number
-                cursor.execute("""
-                    SELECT TOP 1 ClockIn FROM TimeClock 
-                    WHERE Number = ? AND ClockOut IS NULL 
-                    ORDER BY ClockIn DESC
-                """, user_data[1])
-                active_session = cursor.fetchone()
-                
-                if active_session:
-                    st.markdown(f'<div class="status-message">⏱️ Active session: Clocked in since <span class="time-highlight">{active_session[0]}</span></div>', unsafe_allow_html=True)
-                    st.session_state["clocked_in"] = True
-                else:
-                    st.session_state["clocked_in"] = False
-                
-                st.markdown(f'<div class="status-message">✅ Welcome back, {user_data[0]}!</div>', unsafe_allow_html=True)
-            else:
-                st.session_state["registered"] = False
+    if not st.session_state.get("registered"):
+        user_data = lookup_user(device_id)
+        
+        if user_data:
+            st.session_state.update({
+                "registered": True,
+                "user_name": user_data[0],
+                "user_number": user_data[1],
+                "clocked_in": user_data[2] is not None,
+                "clock_in_time": user_data[2]
+            })
+        else:
+            st.session_state["registered"] = False
+    # While a write is in flight the database lags behind, keep the optimistic state
+    elif "pending_write" not in st.session_state:
+        active_session = get_active_session(st.session_state["user_number"])
+        st.session_state.update({
+            "clocked_in": active_session is not None,
+            "clock_in_time": active_session
+        })
+    
+    if st.session_state.get("registered"):
+        if st.session_state.get("clocked_in"):
+            st.markdown(f'<div class="status-message">⏱️ Active session: Clocked in since <span class="time-highlight">{st.session_state.get("clock_in_time")}</span></div>', unsafe_allow_html=True)
+        
+        st.markdown(f'<div class="status-message">✅ Welcome back, {st.session_state["user_name"]}!</div>', unsafe_allow_html=True)
 except Exception as e:
     st.error(f"Database error: {str(e)}")
     st.session_state["registered"] = False
@@ -147,7 +98,6 @@ if "fetch_location" not in st.session_state:
     st.session_state["fetch_location"] = True
 
 if st.session_state.get("fetch_location"):
-    st.markdown('<div class="card">', unsafe_allow_html=True)
     st.info("Please share your location")
     location = streamlit_geolocation()
 
@@ -164,9 +114,7 @@ if st.session_state.get("fetch_location"):
             })
             
             st.markdown(f'<div class="status-message">Location: {lat}, {lon}</div>', unsafe_allow_html=True)
-            st.markdown('<div class="map-container">', unsafe_allow_html=True)
-            st.map(pd.DataFrame([{"lat": lat, "lon": lon}]))
-            st.markdown('</div>', unsafe_allow_html=True)
+            st.map(point_frame(st.session_state["lat_float"], st.session_state["lon_float"]))
             
             try:
                 customer = find_customer_from_location(st.session_state["lat_float"], st.session_state["lon_float"])
@@ -181,117 +129,110 @@ if st.session_state.get("fetch_location"):
                 if st.session_state.get("registered"):
                     if st.session_state.get("clocked_in"):
                         # Clock Out UI
-                        st.markdown('<div class="card">', unsafe_allow_html=True)
-                        st.markdown('<div class="status-message">⏱️ Current Status</div>', unsafe_allow_html=True)
-                        st.markdown(f'<div class="status-message">Active session: Clocked in since <span class="time-highlight">{active_session[0]}</span></div>', unsafe_allow_html=True)
-                        if st.button("🚪 Clock Out", key="clock_out"):
-                            with get_connection() as conn:
-                                with conn.cursor() as cursor:
-                                    now = datetime.now()
-                                    cursor.execute("""
-                                        UPDATE TimeClock SET ClockOut = ? 
-                                        WHERE Number = ? AND ClockOut IS NULL
-                                    """, (now, st.session_state["user_number"]))
-                                    conn.commit()
-                                    st.session_state["clocked_in"] = False
-                                    st.markdown(f'<div class="status-message">👋 Clocked out at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
-                                    st.rerun()
-                        st.markdown('</div>', unsafe_allow_html=True)
+                        with st.container():
+                            st.markdown('<div class="status-message">⏱️ Current Status</div>', unsafe_allow_html=True)
+                            st.markdown(f'<div class="status-message">Active session: Clocked in since <span class="time-highlight">{st.session_state.get("clock_in_time")}</span></div>', unsafe_allow_html=True)
+                            if st.button("🚪 Clock Out", key="clock_out"):
+                                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                                st.session_state["pending_write"] = submit_write(
+                                    clock_out, st.session_state["user_number"],
+                                    device_id=device_id, number=st.session_state["user_number"],
+                                    after=st.session_state.get("pending_write"))
+                                st.session_state.update({"clocked_in": False, "clock_in_time": None})
+                                st.markdown(f'<div class="status-message">👋 Clocked out at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
+                                st.rerun()
                     else:
                         # Clock In UI
-                        st.markdown('<div class="card">', unsafe_allow_html=True)
-                        st.markdown('<div class="status-message">⏱️ Current Status</div>', unsafe_allow_html=True)
-                        st.markdown('<div class="status-message">Not Clocked In</div>', unsafe_allow_html=True)
-                        if st.button("⏱️ Clock In", key="clock_in"):
-                            with get_connection() as conn:
-                                with conn.cursor() as cursor:
-                                    now = datetime.now()
-                                    cursor.execute("""
-                                        INSERT INTO TimeClock (SubContractor, Employee, Number, ClockIn, Lat, Lon, Cookie)
-                                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                                    """, (sub, st.session_state["user_name"], st.session_state["user_number"], 
-                                        now, st.session_state["lat_float"], st.session_state["lon_float"], device_id))
-                                    conn.commit()
-                                    st.session_state["clocked_in"] = True
-                                    st.markdown(f'<div class="status-message">✅ Clocked in at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
-                                    st.balloons()
-                                    st.rerun()
-                        st.markdown('</div>', unsafe_allow_html=True)
+                        with st.container():
+                            st.markdown('<div class="status-message">⏱️ Current Status</div>', unsafe_allow_html=True)
+                            st.markdown('<div class="status-message">Not Clocked In</div>', unsafe_allow_html=True)
+                            if st.button("⏱️ Clock In", key="clock_in"):
+                                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                                st.session_state["pending_write"] = submit_write(
+                                    clock_in, sub, st.session_state["user_name"], st.session_state["user_number"],
+                                    st.session_state["lat_float"], st.session_state["lon_float"], device_id,
+                                    device_id=device_id, number=st.session_state["user_number"],
+                                    after=st.session_state.get("pending_write"))
+                                st.session_state.update({"clocked_in": True, "clock_in_time": now})
+                                st.markdown(f'<div class="status-message">✅ Clocked in at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
+                                st.balloons()
+                                st.rerun()
                 else:
                     # New User Registration
-                    st.markdown('<div class="card">', unsafe_allow_html=True)
-                    st.markdown('<div class="status-message">📝 New User Registration</div>', unsafe_allow_html=True)
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        number = st.text_input("📱 Mobile Number", placeholder="Enter your phone number...", key="phone_input")
+                    with st.container():
+                        st.markdown('<div class="status-message">📝 New User Registration</div>', unsafe_allow_html=True)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            number = st.text_input("📱 Mobile Number", placeholder="Enter your phone number...", key="phone_input")
                     
-                    if number:
-                        with get_connection() as conn:
-                            with conn.cursor() as cursor:
-                                # Check existing number
+                        if number:
+                            with get_cursor() as cursor:
+                                # Check existing number and its open session together
                                 cursor.execute("""
-                                    SELECT Employee, Cookies 
-                                    FROM SubContractorEmployees 
-                                    WHERE Number = ?
+                                    SELECT e.Employee, e.Cookies, t.ClockIn AS ActiveClockIn
+                                    FROM SubContractorEmployees e
+                                    OUTER APPLY (
+                                        SELECT TOP 1 ClockIn FROM TimeClock
+                                        WHERE Number = e.Number AND ClockOut IS NULL
+                                        ORDER BY ClockIn DESC
+                                    ) t
+                                    WHERE e.Number = ?
                                 """, number)
                                 existing = cursor.fetchone()
                                 
                                 if existing:
-                                    # Update device ID and check sessions
+                                    # Update device ID
                                     cursor.execute("""
                                         UPDATE SubContractorEmployees 
                                         SET Cookies = ? 
                                         WHERE Number = ?
                                     """, (device_id, number))
-                                    conn.commit()
-                                    
-                                    # Check for existing session
-                                    cursor.execute("""
-                                        SELECT TOP 1 ClockIn FROM TimeClock 
-                                        WHERE Number = ? AND ClockOut IS NULL
-                                    """, number)
-                                    active_session = cursor.fetchone()
-                                    
+                                    # The device that held this number before no longer maps to it
+                                    lookup_user.clear(device_id)
+                                    if existing.Cookies and existing.Cookies != device_id:
+                                        lookup_user.clear(existing.Cookies)
+                                    get_active_session.clear(number)
+                                
                                     st.session_state.update({
                                         "registered": True,
                                         "user_name": existing.Employee,
                                         "user_number": number,
-                                        "clocked_in": bool(active_session)
+                                        "clocked_in": existing.ActiveClockIn is not None,
+                                        "clock_in_time": existing.ActiveClockIn
                                     })
                                     st.rerun()
                                 else:
                                     with col2:
                                         name = st.text_input("🧑 Full Name", placeholder="Enter your full name...", key="name_input")
                                     if name and st.button("✅ Register & Clock In", key="register"):
-                                        now = datetime.now()
-                                        cursor.execute("""
-                                            INSERT INTO SubContractorEmployees (SubContractor, Employee, Number, Cookies)
-                                            VALUES (?, ?, ?, ?)
-                                        """, (sub, name, number, device_id))
+                                        # sp_RegisterAndClockIn inserts the employee and clocks in as one transaction
                                         cursor.execute("""
-                                            INSERT INTO TimeClock (SubContractor, Employee, Number, ClockIn, Lat, Lon, Cookie)
-                                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                                        """, (sub, name, number, now, 
+                                            SET NOCOUNT ON;
+                                            DECLARE @ClockIn DATETIME;
+                                            EXEC sp_RegisterAndClockIn ?, ?, ?, ?, ?, ?, @ClockIn OUTPUT;
+                                            SELECT @ClockIn;
+                                        """, (sub, name, number, 
                                             st.session_state["lat_float"], st.session_state["lon_float"], device_id))
-                                        conn.commit()
+                                        now = cursor.fetchone()[0]
+                                        lookup_user.clear(device_id)
+                                        get_active_session.clear(number)
                                         st.session_state.update({
                                             "registered": True,
                                             "user_name": name,
                                             "user_number": number,
-                                            "clocked_in": True
+                                            "clocked_in": True,
+                                            "clock_in_time": now
                                         })
                                         st.markdown(f'<div class="status-message">✅ Registered and clocked in at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
                                         st.balloons()
                                         st.rerun()
-                    st.markdown('</div>', unsafe_allow_html=True)
             except Exception as e:
                 st.error(f"Database error: {str(e)}")
-    st.markdown('</div>', unsafe_allow_html=True)
 
 # Handle existing location data
 elif "lat" in st.session_state and "lon" in st.session_state:
     st.markdown(f'<div class="status-message">📌 Your Location: {st.session_state["lat"]}, {st.session_state["lon"]}</div>', unsafe_allow_html=True)
-    st.map(pd.DataFrame([{"lat": st.session_state["lat"], "lon": st.session_state["lon"]}]))
+    st.map(point_frame(st.session_state["lat_float"], st.session_state["lon_float"]))
     
     if "customer" in st.session_state:
         st.markdown(f'<div class="status-message">🛠️ Work Site: {st.session_state["customer"]}</div>', unsafe_allow_html=True)
@@ -301,36 +242,28 @@ elif "lat" in st.session_state and "lon" in st.session_state:
         if st.session_state.get("clocked_in"):
             st.markdown('<div class="status-message">⏱️ Current Status: Clocked In</div>', unsafe_allow_html=True)
             if st.button("🚪 Clock Out"):
-                with get_connection() as conn:
-                    with conn.cursor() as cursor:
-                        now = datetime.now()
-                        cursor.execute("""
-                            UPDATE TimeClock SET ClockOut = ? 
-                            WHERE Number = ? AND ClockOut IS NULL
-                        """, (now, st.session_state["user_number"]))
-                        conn.commit()
-                        st.session_state["clocked_in"] = False
-                        st.markdown(f'<div class="status-message">👋 Clocked out at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
-                        st.rerun()
+                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                st.session_state["pending_write"] = submit_write(
+                    clock_out, st.session_state["user_number"],
+                    device_id=device_id, number=st.session_state["user_number"],
+                    after=st.session_state.get("pending_write"))
+                st.session_state.update({"clocked_in": False, "clock_in_time": None})
+                st.markdown(f'<div class="status-message">👋 Clocked out at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
+                st.rerun()
         else:
             st.markdown('<div class="status-message">⏱️ Current Status: Not Clocked In</div>', unsafe_allow_html=True)
             if st.button("⏱️ Clock In"):
-                with get_connection() as conn:
-                    with conn.cursor() as cursor:
-                        now = datetime.now()
-                        cursor.execute("""
-                            INSERT INTO TimeClock (SubContractor, Employee, Number, ClockIn, Lat, Lon, Cookie)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """, (sub, st.session_state["user_name"], st.session_state["user_number"], 
-                            now, st.session_state["lat_float"], st.session_state["lon_float"], device_id))
-                        conn.commit()
-                        st.session_state["clocked_in"] = True
-                        st.markdown(f'<div class="status-message">✅ Clocked in at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
-                        st.balloons()
-                        st.rerun()
+                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                st.session_state["pending_write"] = submit_write(
+                    clock_in, sub, st.session_state["user_name"], st.session_state["user_number"],
+                    st.session_state["lat_float"], st.session_state["lon_float"], device_id,
+                    device_id=device_id, number=st.session_state["user_number"],
+                    after=st.session_state.get("pending_write"))
+                st.session_state.update({"clocked_in": True, "clock_in_time": now})
+                st.markdown(f'<div class="status-message">✅ Clocked in at <span class="time-highlight">{now.strftime("%H:%M:%S")}</span></div>', unsafe_allow_html=True)
+                st.balloons()
+                st.rerun()
 
 else:
     st.markdown('<div class="status-message">⌛</div>', unsafe_allow_html=True)
 
-# Close main container
-st.markdown('</div>', unsafe_allow_html=True)
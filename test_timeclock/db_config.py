@@ -1,31 +1,67 @@
 # db_config.py
+import queue
+import time
+
 import pyodbc
 import streamlit as st
 
+# Process-wide pool of open (connection, cursor) pairs, shared by every session and rerun
+POOL_SIZE = 10
+# Idle sessions get dropped by the server/network between shifts, so connections
+# that sat in the pool longer than this are closed instead of reused (seconds)
+POOL_IDLE_TIMEOUT = 300
+_POOL = queue.Queue(maxsize=POOL_SIZE)
+
+def _connection_string():
+    db = st.secrets["database"]
+    return (
+        f"Driver={{{db['driver']}}};"
+        f"Server={db['server']};"
+        f"Database={db['database']};"
+        f"UID={db['username']};"
+        f"PWD={db['password']};"
+    )
+
 class DBConnection:
+    # Statements run one after another, so callers share the pooled connection's
+    # single cursor and MARS isn't needed
     def __init__(self):
         self.conn = None
-        
+        self.cursor = None
+
     def __enter__(self):
-        db = st.secrets["database"]
-        connection_string = (
-            f"Driver={{{db['driver']}}};"
-            f"Server={db['server']};"
-            f"Database={db['database']};"
-            f"UID={db['username']};"
-            f"PWD={db['password']};"
-            f"MARS_Connection=Yes;"
-        )
-        self.conn = pyodbc.connect(connection_string)
-        return self.conn
-        
+        # Reuse an already authenticated connection when one is idle
+        while True:
+            try:
+                conn, cursor, last_used = _POOL.get_nowait()
+            except queue.Empty:
+                break
+            if not conn.closed and time.monotonic() - last_used < POOL_IDLE_TIMEOUT:
+                self.conn, self.cursor = conn, cursor
+                return self.cursor
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+        # Every write is a single statement, procedure call or batch with its own
+        # BEGIN TRAN, so let the server commit instead of paying for a COMMIT round-trip
+        self.conn = pyodbc.connect(_connection_string(), autocommit=True)
+        self.cursor = self.conn.cursor()
+        return self.cursor
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            # Instead of closing, reset the connection
-            self.conn.commit()
-            if self.conn.closed:  # Only reset if connection is still open
-                self.conn.close()
+        conn, cursor = self.conn, self.cursor
+        self.conn = self.cursor = None
+        if conn is None or conn.closed:
+            return
+        if isinstance(exc_val, pyodbc.Error):
+            # Possibly a broken connection, don't hand it back out
+            conn.close()
+            return
+        try:
+            _POOL.put_nowait((conn, cursor, time.monotonic()))
+        except queue.Full:
+            conn.close()
 
-# Remove caching completely
-def get_connection():
+def get_cursor():
     return DBConnection()
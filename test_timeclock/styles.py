@@ -0,0 +1,40 @@
+# styles.py
+# Imported once per process, unlike app.py which re-runs on every interaction
+CSS = """
+<style>
+    /* Header styling */
+    .header {
+        text-align: center;
+        margin-bottom: 2rem;
+    }
+    
+    /* Status message styling */
+    .status-message {
+        text-align: center;
+        padding: 1rem;
+        margin: 1rem 0;
+        border-radius: 8px;
+        background: #f8f9fa;
+    }
+    
+    /* Button styling */
+    .stButton > button {
+        width: 100%;
+        padding: 0.75rem;
+        border-radius: 8px;
+        background: #007bff;
+        color: white;
+        border: none;
+    }
+    
+    .stButton > button:hover {
+        background: #0056b3;
+    }
+    
+    /* Input field styling */
+    .stTextInput > div > div > input {
+        border-radius: 8px;
+        padding: 0.75rem;
+    }
+</style>
+"""
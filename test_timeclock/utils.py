@@ -1,15 +1,117 @@
 # utils.py
-from db_config import get_connection
+from concurrent.futures import ThreadPoolExecutor, wait
 
-def find_customer_from_location(lat, lon):
-    with get_connection() as conn:  # Use context manager
-        cursor = conn.cursor()
+import numpy as np
+import pandas as pd
+import streamlit as st
+from db_config import get_cursor
+
+# Job sites are re-read from the database at most this often (seconds)
+SITE_CACHE_TTL = 3600
+
+@st.cache_resource(ttl=SITE_CACHE_TTL)
+def _load_bboxes():
+    # The mapping table is small and rarely changes, so load it once per process
+    with get_cursor() as cursor:
         cursor.execute("""
             SELECT customer_name, min_latitude, max_latitude, min_longitude, max_longitude
             FROM LocationCustomerMapping
         """)
         rows = cursor.fetchall()
-        for row in rows:
-            if row.min_latitude <= lat <= row.max_latitude and row.min_longitude >= lon >= row.max_longitude:
-                return row.customer_name
-        return None
+    names = np.array([row.customer_name for row in rows], dtype=object)
+    bounds = np.array([tuple(row)[1:] for row in rows], dtype=np.float64).reshape(-1, 4)
+    # Sites are stored with longitudes in either order (western hemisphere), so normalize
+    lon_lo = np.minimum(bounds[:, 2], bounds[:, 3])
+    lon_hi = np.maximum(bounds[:, 2], bounds[:, 3])
+    # Sort by min_latitude so a lookup only has to check the boxes starting south of the point
+    order = np.argsort(bounds[:, 0], kind="stable")
+    return names[order], bounds[order, 0], bounds[order, 1], lon_lo[order], lon_hi[order]
+
+def _match_customer(lat, lon):
+    names, min_lat, max_lat, min_lon, max_lon = _load_bboxes()
+    end = np.searchsorted(min_lat, lat, side="right")
+    hit = (lat <= max_lat[:end]) & (min_lon[:end] <= lon) & (lon <= max_lon[:end])
+    idx = np.flatnonzero(hit)
+    return names[idx[0]] if idx.size else None
+
+@st.cache_data(ttl=SITE_CACHE_TTL, max_entries=10000)
+def _customer_at(lat_r, lon_r):
+    return _match_customer(lat_r, lon_r)
+
+def find_customer_from_location(lat, lon):
+    # ~10 m precision, so repeat check-ins from the same spot hit the cache
+    return _customer_at(round(lat, 4), round(lon, 4))
+
+@st.cache_resource(max_entries=1000)
+def _point_frame(lat_r, lon_r):
+    # Shared, not copied: st.map only reads it
+    return pd.DataFrame({"lat": [lat_r], "lon": [lon_r]})
+
+def point_frame(lat, lon):
+    return _point_frame(round(lat, 5), round(lon, 5))
+
+@st.cache_data(ttl=300)
+def lookup_user(device_id):
+    # Registration and active session (by phone number) in one round-trip
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT e.Employee, e.Number,
+                (SELECT TOP 1 t.ClockIn FROM TimeClock t
+                 WHERE t.Number = e.Number AND t.ClockOut IS NULL
+                 ORDER BY t.ClockIn DESC) AS ActiveClockIn
+            FROM SubContractorEmployees e
+            WHERE e.Cookies = ?
+        """, device_id)
+        row = cursor.fetchone()
+    return tuple(row) if row else None
+
+@st.cache_data(ttl=10)
+def get_active_session(number):
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT TOP 1 ClockIn FROM TimeClock 
+            WHERE Number = ? AND ClockOut IS NULL 
+            ORDER BY ClockIn DESC
+        """, number)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def clock_in(sub, employee, number, lat, lon, cookie):
+    # sp_ClockIn stamps ClockIn on the server (UTC) and hands it back as an OUTPUT parameter
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SET NOCOUNT ON;
+            DECLARE @ClockIn DATETIME;
+            EXEC sp_ClockIn ?, ?, ?, ?, ?, ?, @ClockIn OUTPUT;
+            SELECT @ClockIn;
+        """, (sub, employee, number, lat, lon, cookie))
+        return cursor.fetchone()[0]
+
+def clock_out(number):
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SET NOCOUNT ON;
+            DECLARE @ClockOut DATETIME;
+            EXEC sp_ClockOut ?, @ClockOut OUTPUT;
+            SELECT @ClockOut;
+        """, number)
+        return cursor.fetchone()[0]
+
+@st.cache_resource
+def _write_executor():
+    # Shared by every session, so writes keep running across reruns
+    return ThreadPoolExecutor(max_workers=4)
+
+def submit_write(fn, *args, device_id, number, after=None):
+    # Run a clock in/out write off the script thread. `after` is the previous
+    # write from the same session, which has to land first. Only this device's
+    # and number's cached rows are dropped once it lands.
+    def run():
+        if after is not None:
+            wait([after])
+        try:
+            return fn(*args)
+        finally:
+            lookup_user.clear(device_id)
+            get_active_session.clear(number)
+    return _write_executor().submit(run)
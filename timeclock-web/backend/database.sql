@@ -48,10 +48,17 @@ BEGIN
         [SubContractor] NVARCHAR(100) NOT NULL,
         [Employee] NVARCHAR(100) NOT NULL,
         [Number] NVARCHAR(50) NOT NULL,
+        [Cookies] NVARCHAR(100) NULL,
         PRIMARY KEY ([SubContractor], [Employee])
     )
 END
 
+-- Device cookie column used by the Streamlit time clock (older databases lack it)
+IF COL_LENGTH('SubContractorEmployees', 'Cookies') IS NULL
+BEGIN
+    ALTER TABLE [SubContractorEmployees] ADD [Cookies] NVARCHAR(100) NULL
+END
+
 -- Create TimeClock table
 IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[TimeClock]') AND type in (N'U'))
 BEGIN
@@ -70,4 +77,104 @@ BEGIN
         [ClockInNotes] NVARCHAR(MAX) NULL,
         [ClockOutNotes] NVARCHAR(MAX) NULL
     )
-END 
\ No newline at end of file
+END 
+
+GO
+
+-- The filtered index below needs these settings (sqlcmd leaves QUOTED_IDENTIFIER off unless run with -I)
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+-- Add indexes for the registration and open-session lookups
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_TimeClock_OpenSession' AND object_id = OBJECT_ID('TimeClock'))
+BEGIN
+    CREATE INDEX [IX_TimeClock_OpenSession] ON [TimeClock]([Number], [ClockIn] DESC)
+    WHERE [ClockOut] IS NULL
+END
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_SubContractorEmployees_Cookies' AND object_id = OBJECT_ID('SubContractorEmployees'))
+BEGIN
+    CREATE INDEX [IX_SubContractorEmployees_Cookies] ON [SubContractorEmployees]([Cookies]) INCLUDE ([Number])
+END
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_SubContractorEmployees_Number' AND object_id = OBJECT_ID('SubContractorEmployees'))
+BEGIN
+    CREATE INDEX [IX_SubContractorEmployees_Number] ON [SubContractorEmployees]([Number]) INCLUDE ([Cookies])
+END
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_LocationCustomerMapping_Latitude' AND object_id = OBJECT_ID('LocationCustomerMapping'))
+BEGIN
+    CREATE INDEX [IX_LocationCustomerMapping_Latitude] ON [LocationCustomerMapping]([min_latitude], [max_latitude])
+    INCLUDE ([min_longitude], [max_longitude], [customer_name])
+END
+GO
+
+-- Procedures keep the settings they were created with, and writes to TimeClock
+-- fail with error 1934 under the filtered index unless these are on
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+-- Clock in/out procedures; the server stamps the time (UTC) and returns it
+CREATE OR ALTER PROCEDURE [dbo].[sp_ClockIn]
+    @SubContractor NVARCHAR(100),
+    @Employee NVARCHAR(100),
+    @Number NVARCHAR(50),
+    @Lat FLOAT,
+    @Lon FLOAT,
+    @Cookie NVARCHAR(100),
+    @ClockIn DATETIME OUTPUT
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET @ClockIn = SYSUTCDATETIME();
+    INSERT INTO [TimeClock] ([SubContractor], [Employee], [Number], [ClockIn], [Lat], [Lon], [Cookie])
+    VALUES (@SubContractor, @Employee, @Number, @ClockIn, @Lat, @Lon, @Cookie);
+END
+GO
+
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+CREATE OR ALTER PROCEDURE [dbo].[sp_ClockOut]
+    @Number NVARCHAR(50),
+    @ClockOut DATETIME OUTPUT
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET @ClockOut = SYSUTCDATETIME();
+    UPDATE [TimeClock] SET [ClockOut] = @ClockOut
+    WHERE [Number] = @Number AND [ClockOut] IS NULL;
+    -- Nothing was open, so there is no clock-out time to report
+    IF @@ROWCOUNT = 0
+        SET @ClockOut = NULL;
+END
+GO
+
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+-- New employee and their first clock-in as one transaction; SET options made
+-- here revert when the procedure returns, so pooled sessions don't keep them
+CREATE OR ALTER PROCEDURE [dbo].[sp_RegisterAndClockIn]
+    @SubContractor NVARCHAR(100),
+    @Employee NVARCHAR(100),
+    @Number NVARCHAR(50),
+    @Lat FLOAT,
+    @Lon FLOAT,
+    @Cookie NVARCHAR(100),
+    @ClockIn DATETIME OUTPUT
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    BEGIN TRAN;
+    INSERT INTO [SubContractorEmployees] ([SubContractor], [Employee], [Number], [Cookies])
+    VALUES (@SubContractor, @Employee, @Number, @Cookie);
+    EXEC [dbo].[sp_ClockIn] @SubContractor, @Employee, @Number, @Lat, @Lon, @Cookie, @ClockIn OUTPUT;
+    COMMIT TRAN;
+END
+GO